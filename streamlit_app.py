@@ -6,6 +6,16 @@ import json
 import requests
 from io import BytesIO
 import base64
+import hashlib
+import heapq
+import inspect
+import itertools
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
 
 # Configuração da página
 st.set_page_config(
@@ -78,14 +88,190 @@ def local_css():
 # Aplicar o CSS
 local_css()
 
+# Opções do formulário (também definem o espaço de entradas da tabela de risco)
+OPCOES_COMORBIDADES = [
+    "Hipertensão controlada",
+    "Hipertensão não controlada",
+    "Diabetes controlada",
+    "Diabetes descompensada",
+    "Insuficiência cardíaca",
+    "Doença coronariana grave",
+    "DPOC grave",
+    "Asma",
+    "Obesidade mórbida",
+    "Hipotireoidismo",
+    "Doença renal crônica",
+    "Cirrose hepática"
+]
+OPCOES_ASA = ["ASA I", "ASA II", "ASA III", "ASA IV", "ASA V"]
+OPCOES_COMPLEXIDADE = ["Baixa", "Média", "Alta"]
+
+# Idade só importa em faixas: <50, 50-59, 60-69, >=70 (cada valor é o início de uma faixa)
+FAIXAS_IDADE = [0, 50, 60, 70]
+
+NIVEIS_RISCO = ["Baixo", "Médio", "Alto"]
+
+# Arquivo da tabela pré-calculada de risco
+CAMINHO_TABELA_RISCO = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "tabela_risco.bin")
+MAGICO_TABELA_RISCO = b"RISCOTB1"
+
+# Função para ler parâmetros de st.secrets ou das variáveis de ambiente
+def ler_configuracao(nome, padrao, valido):
+    """
+    Lê um parâmetro numérico de st.secrets ou do ambiente, usando o padrão se ausente.
+    Valores não numéricos ou rejeitados por `valido` também usam o padrão, com um aviso
+    """
+    valor = os.environ.get(nome)
+    try:
+        if nome in st.secrets:
+            valor = st.secrets[nome]
+    except Exception:
+        pass # Sem arquivo de secrets configurado
+
+    if valor is None:
+        return padrao
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        numero = None
+    if numero is None or not valido(numero):
+        st.warning(f"Configuração inválida para {nome}: {valor!r}. Usando o padrão ({padrao}).")
+        return padrao
+    return numero
+
+# Cota do provedor para o Gemini, por API Key (ajuste conforme o plano da chave)
+GEMINI_REQUISICOES_POR_MINUTO = ler_configuracao("GEMINI_REQUISICOES_POR_MINUTO", 5, lambda v: v > 0)
+# A rajada precisa comportar ao menos um token inteiro
+GEMINI_RAJADA_MAXIMA = ler_configuracao("GEMINI_RAJADA_MAXIMA", 2, lambda v: v >= 1)
+# Tempo máximo (segundos) na fila antes de usar apenas as recomendações por regras
+GEMINI_ESPERA_MAXIMA = ler_configuracao("GEMINI_ESPERA_MAXIMA", 30, lambda v: v >= 0)
+
+# Prioridade na fila do Gemini por nível de risco (menor é atendido primeiro)
+PRIORIDADE_RISCO = {"Alto": 0, "Médio": 1, "Baixo": 2}
+
+class AgendadorGemini:
+    """
+    Agendador das chamadas ao Gemini de uma API Key, compartilhado entre as sessões.
+    Um token bucket limita a taxa à cota do provedor e uma fila de prioridade
+    atende primeiro os riscos mais altos, alternando entre sessões dentro de
+    cada prioridade
+    """
+    def __init__(self, requisicoes_por_minuto, rajada_maxima, espera_maxima, relogio=time.monotonic):
+        if requisicoes_por_minuto <= 0:
+            raise ValueError("requisicoes_por_minuto deve ser maior que zero")
+        if rajada_maxima < 1:
+            raise ValueError("rajada_maxima deve ser pelo menos 1")
+        if espera_maxima < 0:
+            raise ValueError("espera_maxima não pode ser negativa")
+        self.taxa = requisicoes_por_minuto / 60.0
+        self.rajada_maxima = rajada_maxima
+        self.espera_maxima = espera_maxima
+        self._relogio = relogio
+        self._tokens = float(rajada_maxima)
+        self._ultima_reposicao = relogio()
+        self._fila = []
+        self._sequencia = itertools.count()
+        self._rodada_atual = 0
+        self._rodada_por_sessao = {}
+        self._condicao = threading.Condition()
+        # Métricas
+        self._atendidas = 0
+        self._expiradas = 0
+        self._espera_total = 0.0
+        self._maior_espera = 0.0
+        self._maior_fila = 0
+
+    def _repor_tokens(self):
+        agora = self._relogio()
+        self._tokens = min(self.rajada_maxima, self._tokens + (agora - self._ultima_reposicao) * self.taxa)
+        self._ultima_reposicao = agora
+
+    def adquirir(self, risco=None, id_sessao=None):
+        """
+        Aguarda a vez na fila e consome um token.
+        Retorna False se a espera máxima for excedida
+        """
+        inicio = self._relogio()
+        limite = inicio + self.espera_maxima
+
+        with self._condicao:
+            # Cada sessão avança uma rodada por pedido, para que uma sessão com muitos
+            # pedidos não passe à frente das demais com a mesma prioridade
+            rodada = max(self._rodada_atual, self._rodada_por_sessao.get(id_sessao, -1) + 1)
+            self._rodada_por_sessao[id_sessao] = rodada
+            pedido = [PRIORIDADE_RISCO.get(risco, len(PRIORIDADE_RISCO)), rodada, next(self._sequencia)]
+            heapq.heappush(self._fila, pedido)
+            self._maior_fila = max(self._maior_fila, len(self._fila))
+
+            while True:
+                self._repor_tokens()
+                agora = self._relogio()
+
+                if self._fila[0] is pedido and self._tokens >= 1:
+                    heapq.heappop(self._fila)
+                    self._tokens -= 1
+                    self._rodada_atual = max(self._rodada_atual, rodada)
+                    # Sessões atrás da rodada atual já seriam tratadas como novas
+                    self._rodada_por_sessao = {
+                        sessao: r for sessao, r in self._rodada_por_sessao.items() if r >= self._rodada_atual
+                    }
+                    espera = agora - inicio
+                    self._atendidas += 1
+                    self._espera_total += espera
+                    self._maior_espera = max(self._maior_espera, espera)
+                    self._condicao.notify_all()
+                    return True
+
+                if agora >= limite:
+                    self._fila.remove(pedido)
+                    heapq.heapify(self._fila)
+                    self._expiradas += 1
+                    self._condicao.notify_all()
+                    return False
+
+                tempo_espera = limite - agora
+                if self._fila[0] is pedido:
+                    tempo_espera = min(tempo_espera, (1 - self._tokens) / self.taxa)
+                self._condicao.wait(tempo_espera)
+
+    def metricas(self):
+        """
+        Retorna a profundidade da fila e os tempos de espera observados
+        """
+        with self._condicao:
+            return {
+                "fila_atual": len(self._fila),
+                "maior_fila": self._maior_fila,
+                "atendidas": self._atendidas,
+                "expiradas": self._expiradas,
+                "espera_media": self._espera_total / self._atendidas if self._atendidas else 0.0,
+                "maior_espera": self._maior_espera
+            }
+
+# Uma instância por API Key (e configuração) no processo, compartilhada entre as sessões do Streamlit
+@st.cache_resource
+def _agendador_por_chave(hash_chave, requisicoes_por_minuto, rajada_maxima, espera_maxima):
+    return AgendadorGemini(requisicoes_por_minuto, rajada_maxima, espera_maxima)
+
+def obter_agendador_gemini(api_key):
+    """
+    Retorna o agendador da API Key; o provedor aplica a cota por chave
+    """
+    hash_chave = hashlib.sha256(api_key.encode()).hexdigest()
+    return _agendador_por_chave(hash_chave, GEMINI_REQUISICOES_POR_MINUTO, GEMINI_RAJADA_MAXIMA, GEMINI_ESPERA_MAXIMA)
+
 # Função para consultar a API do Gemini (será usada quando necessário)
-def consultar_gemini(prompt, api_key):
+def consultar_gemini(prompt, api_key, risco=None, id_sessao=None):
     """
     Função para consultar a API do Gemini usando a biblioteca oficial.
+    A chamada passa pelo agendador da API Key, priorizada pelo risco.
     """
     if not api_key:
         return "Erro: API Key do Gemini não fornecida."
 
+    if not obter_agendador_gemini(api_key).adquirir(risco, id_sessao):
+        return "Erro: Tempo máximo de espera na fila da IA excedido. Exibindo apenas as recomendações padrão."
+
     try:
         # Configura a API Key
         genai.configure(api_key=api_key)
@@ -196,6 +382,162 @@ def calcular_risco_cirurgico(respostas):
     else:
         return "Baixo", pontos
 
+# Funções da tabela pré-calculada de risco cirúrgico
+def _assinatura_regras_risco():
+    """
+    Gera uma assinatura das regras de risco; muda sempre que calcular_risco_cirurgico
+    ou o espaço de entradas da tabela forem alterados
+    """
+    # O código-fonte é estável entre execuções (o repr de objetos de código inclui endereços de memória)
+    h = hashlib.sha256()
+    h.update(inspect.getsource(calcular_risco_cirurgico).encode())
+    h.update(repr((OPCOES_COMORBIDADES, OPCOES_ASA, OPCOES_COMPLEXIDADE, FAIXAS_IDADE, NIVEIS_RISCO)).encode())
+    return h.digest()
+
+def _total_entradas_tabela_risco():
+    """
+    Número de combinações de respostas cobertas pela tabela
+    """
+    return (len(FAIXAS_IDADE) * (1 << len(OPCOES_COMORBIDADES)) * len(OPCOES_ASA)
+            * 2 * 2 * 2 * len(OPCOES_COMPLEXIDADE))
+
+def _faixa_idade(idade):
+    """
+    Retorna o índice da faixa etária correspondente à idade
+    """
+    faixa = 0
+    for i, inicio in enumerate(FAIXAS_IDADE):
+        if idade >= inicio:
+            faixa = i
+    return faixa
+
+def indice_tabela_risco(respostas):
+    """
+    Calcula o índice compactado das respostas na tabela de risco.
+    Ordem (mais significativo primeiro): faixa etária, comorbidades (bitmask),
+    ASA, anticoagulantes, corticoides, cirurgia recente, complexidade
+    """
+    mascara = 0
+    for comorbidade in respostas['comorbidades']:
+        mascara |= 1 << OPCOES_COMORBIDADES.index(comorbidade)
+
+    indice = _faixa_idade(respostas['idade'])
+    indice = indice * (1 << len(OPCOES_COMORBIDADES)) + mascara
+    indice = indice * len(OPCOES_ASA) + OPCOES_ASA.index(respostas['asa'])
+    indice = indice * 2 + bool(respostas['usa_anticoagulantes'])
+    indice = indice * 2 + bool(respostas['uso_corticoides'])
+    indice = indice * 2 + bool(respostas['cirurgia_recente'])
+    indice = indice * len(OPCOES_COMPLEXIDADE) + OPCOES_COMPLEXIDADE.index(respostas['complexidade_cirurgia'])
+    return indice
+
+def _combinacoes_tabela_risco():
+    """
+    Percorre todas as combinações de respostas, na mesma ordem do índice da tabela
+    """
+    for inicio_faixa in FAIXAS_IDADE:
+        for mascara in range(1 << len(OPCOES_COMORBIDADES)):
+            comorbidades = [c for i, c in enumerate(OPCOES_COMORBIDADES) if mascara >> i & 1]
+            for asa, anticoagulantes, corticoides, recente, complexidade in itertools.product(
+                OPCOES_ASA, (False, True), (False, True), (False, True), OPCOES_COMPLEXIDADE
+            ):
+                # Lista própria por combinação: uma implementação que altere as respostas
+                # não pode corromper as combinações seguintes
+                yield {
+                    'idade': inicio_faixa,
+                    'comorbidades': list(comorbidades),
+                    'asa': asa,
+                    'usa_anticoagulantes': anticoagulantes,
+                    'uso_corticoides': corticoides,
+                    'cirurgia_recente': recente,
+                    'complexidade_cirurgia': complexidade
+                }
+
+def _compactar_resultado(risco, pontos):
+    """
+    Compacta (risco, pontos) em um byte: 2 bits para o nível e 6 bits para a pontuação
+    """
+    if not 0 <= pontos < 64:
+        raise ValueError(f"Pontuação fora do intervalo da tabela: {pontos}")
+    return NIVEIS_RISCO.index(risco) << 6 | pontos
+
+def _descompactar_resultado(valor):
+    """
+    Converte um byte da tabela de volta para (risco, pontos)
+    """
+    return NIVEIS_RISCO[valor >> 6], valor & 0x3F
+
+def construir_tabela_risco(caminho=CAMINHO_TABELA_RISCO):
+    """
+    Gera a tabela exaustiva de risco a partir de calcular_risco_cirurgico e grava em disco
+    """
+    tabela = bytearray(
+        _compactar_resultado(*calcular_risco_cirurgico(respostas))
+        for respostas in _combinacoes_tabela_risco()
+    )
+
+    diretorio = os.path.dirname(caminho)
+    os.makedirs(diretorio, exist_ok=True)
+    # Temporário único por chamada: construções simultâneas não disputam o mesmo arquivo
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, suffix=".tmp")
+    try:
+        with os.fdopen(descritor, "wb") as arquivo:
+            arquivo.write(MAGICO_TABELA_RISCO)
+            arquivo.write(_assinatura_regras_risco())
+            arquivo.write(tabela)
+        # Substituição atômica: leitores veem a tabela antiga ou a nova, nunca uma incompleta
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+
+# Uma única instância por processo; o Streamlit serializa a primeira carga entre sessões
+@st.cache_resource
+def carregar_tabela_risco(caminho=CAMINHO_TABELA_RISCO):
+    """
+    Mapeia a tabela de risco em memória (sem cópia), regenerando-a se as regras mudaram
+    """
+    cabecalho = MAGICO_TABELA_RISCO + _assinatura_regras_risco()
+    tamanho_esperado = len(cabecalho) + _total_entradas_tabela_risco()
+    try:
+        with open(caminho, "rb") as arquivo:
+            # Um arquivo truncado pode ter cabeçalho válido, por isso o tamanho também é conferido
+            valido = (arquivo.read(len(cabecalho)) == cabecalho
+                      and os.fstat(arquivo.fileno()).st_size == tamanho_esperado)
+    except FileNotFoundError:
+        valido = False
+
+    if not valido:
+        construir_tabela_risco(caminho)
+
+    with open(caminho, "rb") as arquivo:
+        mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapa)[len(cabecalho):]
+
+def consultar_risco_tabelado(respostas, caminho=CAMINHO_TABELA_RISCO):
+    """
+    Consulta o risco cirúrgico na tabela pré-calculada em O(1).
+    Retorna o mesmo (risco, pontos) de calcular_risco_cirurgico
+    """
+    tabela = carregar_tabela_risco(caminho)
+    return _descompactar_resultado(tabela[indice_tabela_risco(respostas)])
+
+def verificar_paridade_risco(funcao, caminho=CAMINHO_TABELA_RISCO, limite=10):
+    """
+    Compara uma implementação alternativa de cálculo de risco com a tabela em todas
+    as combinações possíveis. Retorna até `limite` divergências como
+    (respostas, esperado, obtido); lista vazia indica paridade completa
+    """
+    tabela = carregar_tabela_risco(caminho)
+    divergencias = []
+    for indice, respostas in enumerate(_combinacoes_tabela_risco()):
+        esperado = _descompactar_resultado(tabela[indice])
+        obtido = tuple(funcao(respostas))
+        if obtido != esperado:
+            divergencias.append((respostas, esperado, obtido))
+            if len(divergencias) >= limite:
+                break
+    return divergencias
+
 # Função para determinar o tempo de jejum
 def determinar_jejum(tipo_cirurgia, tipo_anestesia):
     """
@@ -222,7 +564,7 @@ def determinar_jejum(tipo_cirurgia, tipo_anestesia):
     }
 
 # Função para gerar recomendações personalizadas
-def gerar_recomendacoes(respostas, risco, api_key=None):
+def gerar_recomendacoes(respostas, risco, api_key=None, id_sessao=None):
     """
     Gera recomendações personalizadas com base nas respostas e no risco calculado
     """
@@ -271,7 +613,7 @@ def gerar_recomendacoes(respostas, risco, api_key=None):
         Recomendação 3 aqui.
         """
 
-        resultado_ia = consultar_gemini(prompt, api_key)
+        resultado_ia = consultar_gemini(prompt, api_key, risco, id_sessao)
 
         # Verifica se a consulta à IA foi bem-sucedida e não retornou uma mensagem de erro
         if resultado_ia and not resultado_ia.startswith("Erro:"):
@@ -389,6 +731,13 @@ def main():
         st.header("⚙️ Configurações")
         api_key = st.text_input("API Key do Gemini (opcional)", type="password")
         st.write("---")
+        if api_key:
+            metricas = obter_agendador_gemini(api_key).metricas()
+            st.caption(
+                f"Fila da IA: {metricas['fila_atual']} (máx. {metricas['maior_fila']}) · "
+                f"Espera média: {metricas['espera_media']:.1f}s (máx. {metricas['maior_espera']:.1f}s) · "
+                f"Expiradas: {metricas['expiradas']}"
+            )
         st.write("Protótipo em desenvolvimento")
     
     # Abas da aplicação
@@ -412,6 +761,9 @@ def main():
                 'complexidade_cirurgia': 'Média'
             }
         
+        if 'id_sessao' not in st.session_state:
+            st.session_state.id_sessao = uuid.uuid4().hex
+
         if 'resultado_calculado' not in st.session_state:
             st.session_state.resultado_calculado = False
             
@@ -428,27 +780,14 @@ def main():
                 
                 st.session_state.respostas['comorbidades'] = st.multiselect(
                     "Comorbidades",
-                    options=[
-                        "Hipertensão controlada", 
-                        "Hipertensão não controlada", 
-                        "Diabetes controlada", 
-                        "Diabetes descompensada",
-                        "Insuficiência cardíaca",
-                        "Doença coronariana grave",
-                        "DPOC grave",
-                        "Asma",
-                        "Obesidade mórbida",
-                        "Hipotireoidismo",
-                        "Doença renal crônica",
-                        "Cirrose hepática"
-                    ],
+                    options=OPCOES_COMORBIDADES,
                     default=st.session_state.respostas['comorbidades']
                 )
                 
                 st.session_state.respostas['asa'] = st.selectbox(
                     "Classificação ASA",
-                    options=["ASA I", "ASA II", "ASA III", "ASA IV", "ASA V"],
-                    index=["ASA I", "ASA II", "ASA III", "ASA IV", "ASA V"].index(st.session_state.respostas['asa']),
+                    options=OPCOES_ASA,
+                    index=OPCOES_ASA.index(st.session_state.respostas['asa']),
                     help="ASA I: Paciente saudável; ASA II: Doença sistêmica leve; ASA III: Doença sistêmica grave; ASA IV: Doença sistêmica grave com risco de vida; ASA V: Paciente moribundo"
                 )
                 
@@ -493,14 +832,15 @@ def main():
                 
                 st.session_state.respostas['complexidade_cirurgia'] = st.select_slider(
                     "Complexidade da Cirurgia",
-                    options=["Baixa", "Média", "Alta"],
+                    options=OPCOES_COMPLEXIDADE,
                     value=st.session_state.respostas['complexidade_cirurgia']
                 )
             
             submit_button = st.form_submit_button("Calcular Risco")
             
             if submit_button:
-                with st.spinner("Calculando risco cirúrgico..."):
+                mensagem_espera = "Calculando risco cirúrgico e aguardando a fila da IA..." if api_key else "Calculando risco cirúrgico..."
+                with st.spinner(mensagem_espera):
                     # Calcular risco
                     risco, pontos = calcular_risco_cirurgico(st.session_state.respostas)
                     
@@ -511,7 +851,7 @@ def main():
                     )
                     
                     # Gerar recomendações
-                    recomendacoes = gerar_recomendacoes(st.session_state.respostas, risco, api_key)
+                    recomendacoes = gerar_recomendacoes(st.session_state.respostas, risco, api_key, st.session_state.id_sessao)
                     
                     # Gerar HTML do relatório
                     relatorio_html = gerar_relatorio_pdf(
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import streamlit_app as app
+
+
+class RelogioFalso:
+    def __init__(self):
+        self.agora = 0.0
+
+    def __call__(self):
+        return self.agora
+
+
+def esperar_ate(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "condição não atingida a tempo"
+        time.sleep(0.005)
+
+
+def enfileirar(agendador, pedidos):
+    """
+    Enfileira os pedidos em ordem, um por thread, com o bucket vazio
+    """
+    resultados = []
+    trava = threading.Lock()
+    threads = []
+
+    def pedir(risco, sessao):
+        ok = agendador.adquirir(risco, sessao)
+        with trava:
+            resultados.append((risco, sessao, ok))
+
+    for i, (risco, sessao) in enumerate(pedidos):
+        thread = threading.Thread(target=pedir, args=(risco, sessao))
+        thread.start()
+        threads.append(thread)
+        esperar_ate(lambda: agendador.metricas()["fila_atual"] + len(resultados) == i + 1)
+    return resultados, threads
+
+
+def test_prioridade_e_alternancia_entre_sessoes():
+    relogio = RelogioFalso()
+    # 20 por segundo com rajada 1: cada avanço de 0,06s no relógio libera exatamente um token
+    agendador = app.AgendadorGemini(1200, 1, 1000, relogio=relogio)
+    # A sessão "a" já foi atendida, então seu próximo pedido fica atrás do de "b"
+    assert agendador.adquirir("Baixo", "a")
+
+    pedidos = [("Baixo", "a"), ("Baixo", "b"), ("Alto", "c"), ("Médio", "d")]
+    resultados, threads = enfileirar(agendador, pedidos)
+
+    for atendidos in range(1, len(pedidos) + 1):
+        relogio.agora += 0.06
+        esperar_ate(lambda: len(resultados) == atendidos)
+    for thread in threads:
+        thread.join()
+
+    assert resultados == [
+        ("Alto", "c", True),
+        ("Médio", "d", True),
+        ("Baixo", "b", True),
+        ("Baixo", "a", True),
+    ]
+
+
+def test_espera_maxima_expira_pedido():
+    agendador = app.AgendadorGemini(1, 1, 0.1)
+    assert agendador.adquirir("Alto", "a")
+    assert not agendador.adquirir("Alto", "b")
+
+    metricas = agendador.metricas()
+    assert metricas["atendidas"] == 1
+    assert metricas["expiradas"] == 1
+    assert metricas["fila_atual"] == 0
+
+
+
+@pytest.mark.parametrize("parametros", [(0, 2, 30), (5, 0.5, 30), (5, 2, -1)])
+def test_parametros_invalidos(parametros):
+    with pytest.raises(ValueError):
+        app.AgendadorGemini(*parametros)
+
+
+@pytest.mark.parametrize("valor, esperado", [("7", 7.0), ("0", 5), ("abc", 5)])
+def test_ler_configuracao_usa_padrao_se_invalida(monkeypatch, valor, esperado):
+    monkeypatch.setenv("GEMINI_TESTE", valor)
+    assert app.ler_configuracao("GEMINI_TESTE", 5, lambda v: v > 0) == esperado
@@ -0,0 +1,42 @@
+import pytest
+
+import streamlit_app as app
+
+
+@pytest.fixture(scope="module")
+def caminho_tabela(tmp_path_factory):
+    caminho = str(tmp_path_factory.mktemp("tabela") / "tabela_risco.bin")
+    app.carregar_tabela_risco(caminho)
+    return caminho
+
+
+def test_paridade_com_calcular_risco_cirurgico(caminho_tabela):
+    assert app.verificar_paridade_risco(app.calcular_risco_cirurgico, caminho_tabela) == []
+
+
+def test_paridade_detecta_divergencia(caminho_tabela):
+    divergencias = app.verificar_paridade_risco(lambda respostas: ("Baixo", 0), caminho_tabela, limite=3)
+    assert len(divergencias) == 3
+
+
+def test_consulta_tabelada(caminho_tabela):
+    respostas = {
+        'idade': 72,
+        'comorbidades': ['Insuficiência cardíaca', 'DPOC grave'],
+        'asa': 'ASA III',
+        'usa_anticoagulantes': True,
+        'uso_corticoides': False,
+        'cirurgia_recente': False,
+        'complexidade_cirurgia': 'Alta'
+    }
+    assert app.consultar_risco_tabelado(respostas, caminho_tabela) == ("Alto", 17)
+    assert app.consultar_risco_tabelado(respostas, caminho_tabela) == app.calcular_risco_cirurgico(respostas)
+
+
+def test_arquivo_truncado_e_regenerado(caminho_tabela, tmp_path):
+    caminho = str(tmp_path / "tabela_risco.bin")
+    with open(caminho_tabela, "rb") as origem, open(caminho, "wb") as destino:
+        destino.write(origem.read()[:1000])
+
+    tabela = app.carregar_tabela_risco(caminho)
+    assert len(tabela) == app._total_entradas_tabela_risco()